@@ -189,14 +189,13 @@ class KojiImportBase(Plugin):
         :type _filter: dict[str, any] or None
         :return: an iterator that yields a tuple in form (platform, output).
         """
+        filter_items = tuple(_filter.items()) if _filter else ()
         for build_platform, metadata in self._builds_metadatas.items():
             if platform is not None and build_platform != platform:
                 continue
             for output in metadata["output"]:
-                if _filter:
-                    if all(output.get(key) == value for key, value in _filter.items()):
-                        yield build_platform, output
-                else:
+                # an empty filter matches every output
+                if all(output.get(key) == value for key, value in filter_items):
                     yield build_platform, output
 
     def get_output(self, buildroot_id: str) -> List[Dict[str, Any]]:
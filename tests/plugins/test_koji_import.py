@@ -6,14 +6,16 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
-from collections import namedtuple
+from collections import Counter, namedtuple
 import json
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+from unittest.mock import ANY
 from atomic_reactor.plugins.fetch_docker_archive import FetchDockerArchivePlugin
 from atomic_reactor.plugins.add_help import AddHelpPlugin
 from atomic_reactor.plugins.generate_sbom import GenerateSbomPlugin
 
+import jsonschema
 import koji
 import koji_cli.lib
 import os
@@ -31,9 +33,7 @@ from atomic_reactor.plugins.add_filesystem import AddFilesystemPlugin
 from atomic_reactor.plugins.fetch_sources import PLUGIN_FETCH_SOURCES_KEY
 from atomic_reactor.plugin import PluginFailedException
 from atomic_reactor.inner import DockerBuildWorkflow, TagConf
-from atomic_reactor.util import (ManifestDigest, DockerfileImages,
-                                 get_manifest_media_version,
-                                 graceful_chain_get, RegistryClient)
+from atomic_reactor.util import ManifestDigest, DockerfileImages, RegistryClient
 from atomic_reactor.source import GitSource, PathSource
 from atomic_reactor.constants import (IMAGE_TYPE_DOCKER_ARCHIVE, KOJI_BTYPE_OPERATOR_MANIFESTS,
                                       PLUGIN_ADD_FILESYSTEM_KEY,
@@ -94,14 +94,179 @@ PUSH_OPERATOR_MANIFESTS_RESULTS = {
 }
 TIME = '2022-05-27T01:46:50Z'
 PLATFORMS = ['x86_64', 's390x']
+# content of the OSBS build log uploaded from the mocked pipeline run logs
+OSBS_BUILD_LOG = b"log message A\nlog message B\nlog message C\n"
+# architecture the source container image archive is named after
+MACHINE = os.uname().machine
+KOJI_UPLOAD_DIR = 'upload-dir'
+KOJI_METADATA_UPLOAD_PATH = os.path.join(KOJI_UPLOAD_DIR, KOJI_METADATA_FILENAME)
+
+# keys of the build section in imported koji metadata
+KOJI_BUILD_KEYS = frozenset({
+    'name',
+    'version',
+    'release',
+    'source',
+    'start_time',
+    'end_time',
+    'extra',          # optional but always supplied
+    'owner',
+})
+KOJI_RESERVED_BUILD_KEYS = KOJI_BUILD_KEYS | {'build_id'}
+
+# build metadata outputs shared by the _iter_build_metadata_outputs test cases
+LOG_OUTPUT = {"type": "log", "filename": "build.log"}
+IMAGE_OUTPUT = {"type": "docker-image", "filename": "img.tar.gz"}
+
+# (build_metadatas, platform, _filter, expected) cases for _iter_build_metadata_outputs
+BUILD_METADATA_OUTPUTS_CASES = [
+    pytest.param({}, None, None, [], id='empty-no-filter'),
+    pytest.param({}, None, {}, [], id='empty-empty-filter'),
+    pytest.param({}, None, {"type": "docker-image"}, [], id='empty-type-filter'),
+    pytest.param({"x86_64": {"output": []}}, None, {"type": "docker-image"}, [],
+                 id='no-outputs'),
+    # No output is found by non-existing type.
+    pytest.param({"x86_64": {"output": [{"type": "log"}]}}, None,
+                 {"type": "docker-image"}, [],
+                 id='unmatched-type'),
+    # No output is found by unknown key.
+    pytest.param({"x86_64": {"output": [{"type": "log"}]}}, None,
+                 {"filename": "file.tar.gz"}, [],
+                 id='unknown-key'),
+    pytest.param({"x86_64": {"output": [{"type": "log"}]}}, None,
+                 {"type": "log", "filename": "file.tar.gz"}, [],
+                 id='partially-matched-filters'),
+    # Output is found by type.
+    pytest.param({"x86_64": {"output": [{"type": "log"}, {"type": "docker-image"}]}}, None,
+                 {"type": "docker-image"}, [("x86_64", {"type": "docker-image"})],
+                 id='matched-type'),
+    # No output is found with multiple filters.
+    pytest.param({"x86_64": {"output": [LOG_OUTPUT, IMAGE_OUTPUT]}}, None,
+                 {"type": "docker-image", "filename": "img-file"}, [],
+                 id='unmatched-filters'),
+    # Find out output with multiple filters
+    pytest.param({"x86_64": {"output": [LOG_OUTPUT, IMAGE_OUTPUT]}}, None,
+                 IMAGE_OUTPUT, [("x86_64", IMAGE_OUTPUT)],
+                 id='matched-filters'),
+    # No output if platform does not exist.
+    pytest.param({"x86_64": {"output": [LOG_OUTPUT]}}, "s390x", None, [],
+                 id='missing-platform'),
+    # Filter outputs by platform
+    pytest.param({"x86_64": {"output": [LOG_OUTPUT]}}, "x86_64", None,
+                 [("x86_64", LOG_OUTPUT)],
+                 id='platform'),
+    # Filter outputs by combination of platform and filter
+    pytest.param({"x86_64": {"output": [LOG_OUTPUT, IMAGE_OUTPUT]}}, "x86_64",
+                 {"type": "docker-image"}, [("x86_64", IMAGE_OUTPUT)],
+                 id='platform-and-filter'),
+    # Iterator outputs from multiple platforms
+    pytest.param(
+        {
+            "x86_64": {"output": [LOG_OUTPUT, IMAGE_OUTPUT]},
+            "s390x": {"output": [LOG_OUTPUT, IMAGE_OUTPUT]},
+        },
+        None,
+        {"type": "docker-image"},
+        [("x86_64", IMAGE_OUTPUT), ("s390x", IMAGE_OUTPUT)],
+        id='multiple-platforms',
+    ),
+    pytest.param(
+        {
+            "x86_64": {"output": [LOG_OUTPUT, IMAGE_OUTPUT]},
+            # s390x will not be included since no output in docker-image type.
+            "s390x": {"output": [LOG_OUTPUT]},
+        },
+        None,
+        {"type": "docker-image"},
+        [("x86_64", IMAGE_OUTPUT)],
+        id='multiple-platforms-partial-match',
+    ),
+]
+
+FS_TASK_ID_MISSING_LOG = "expected filesystem-koji-task-id in result"
+# (fs_result, expected, log) cases for _filesystem_koji_task_id
+FILESYSTEM_KOJI_TASK_ID_CASES = [
+    pytest.param(None, None, None, id='no-result'),
+    pytest.param({}, None, FS_TASK_ID_MISSING_LOG, id='empty-result'),
+    pytest.param({"other-result": 1234}, None, FS_TASK_ID_MISSING_LOG, id='missing-task-id'),
+    pytest.param({"filesystem-koji-task-id": "task_id"}, None, f"invalid task ID {'task_id'!r}",
+                 id='invalid-task-id'),
+    pytest.param({"filesystem-koji-task-id": 1}, 1, None, id='int-task-id'),
+    pytest.param({"filesystem-koji-task-id": "1"}, 1, None, id='str-task-id'),
+]
+
+
+# Structure every koji metadata is expected to have, checked in one pass
+# rather than asserting each level separately
+KOJI_METADATA_SCHEMA = {
+    'type': 'object',
+    'required': ['build'],
+    'properties': {
+        'build': {
+            'type': 'object',
+            'required': ['extra'],
+            'properties': {
+                'extra': {
+                    'type': 'object',
+                    'required': ['image'],
+                    'properties': {
+                        'image': {'type': 'object'},
+                    },
+                },
+            },
+        },
+    },
+}
+koji_metadata_validator = jsonschema.Draft7Validator(KOJI_METADATA_SCHEMA)
+
+
+# Top-level keys of the koji metadata imported by a successful build and the
+# nested keys which are not already covered by KOJI_METADATA_SCHEMA
+KOJI_IMPORT_METADATA_SCHEMA = {
+    'type': 'object',
+    'required': ['metadata_version', 'build', 'buildroots', 'output'],
+    'additionalProperties': False,
+    'properties': {
+        'metadata_version': {'enum': ['0', 0]},
+        'build': {
+            'type': 'object',
+            'required': ['start_time', 'end_time'],
+            'properties': {
+                'start_time': {'type': 'integer', 'minimum': 1},
+                'end_time': {'type': 'integer', 'minimum': 1},
+                'extra': {
+                    'type': 'object',
+                    'required': ['osbs_build'],
+                    'properties': {
+                        'osbs_build': {
+                            'type': 'object',
+                            'required': ['kind', 'subtypes'],
+                        },
+                    },
+                },
+            },
+        },
+        'buildroots': {'type': 'array', 'minItems': 1},
+        'output': {'type': 'array'},
+    },
+}
+koji_import_metadata_validator = jsonschema.Draft7Validator(KOJI_IMPORT_METADATA_SCHEMA)
+
+
+def get_build_extra(data):
+    """Validate the basic structure of koji metadata and return build.extra"""
+    koji_metadata_validator.validate(data)
+    return data['build']['extra']
 
 
 class MockedClientSession(object):
     TAG_TASK_ID = 1234
+    BUILD_ID = '123'
     DEST_TAG = 'images-candidate'
 
     def __init__(self, hub, opts=None, task_states=None):
-        self.metadata: Dict[str, Any] = {}
+        self._metadata: Optional[Dict[str, Any]] = {}
+        self._uploaded_metadata: bytes = b''
         # destination filename on Koji => file content
         self.uploaded_files: Dict[str, bytes] = {}
         self.build_tags = {}
@@ -116,6 +281,15 @@ class MockedClientSession(object):
         self.server_dir = None
         self.refunded_build = False
         self.fail_state = None
+        # (metadata, server_dir, token) of every CGImport call
+        self.cgimport_calls = []
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Metadata passed to CGImport, empty if nothing was imported"""
+        if self._metadata is None:
+            self._metadata = json.loads(self._uploaded_metadata)
+        return self._metadata
 
     def krb_login(self, principal=None, keytab=None, proxyuser=None):
         return True
@@ -133,13 +307,13 @@ class MockedClientSession(object):
             self.uploaded_files[name] = fp.read()
 
     def CGImport(self, metadata, server_dir, token=None):
-        # metadata cannot be defined in __init__ because tests assume
-        # the attribute will not be defined unless this method is called
-        self.metadata = json.loads(
-            self.uploaded_files[KOJI_METADATA_FILENAME]
-        )  # pylint: disable=attribute-defined-outside-init
+        self.cgimport_calls.append((metadata, server_dir, token))
+        # keep the imported metadata as uploaded, it is decoded only if a test
+        # looks at it
+        self._uploaded_metadata = self.uploaded_files[KOJI_METADATA_FILENAME]
+        self._metadata = None
         self.server_dir = server_dir
-        return {"id": "123"}
+        return {"id": self.BUILD_ID}
 
     def getBuildTarget(self, target):
         return {'dest_tag_name': self.DEST_TAG}
@@ -218,34 +392,6 @@ def is_string_type(obj):
     return isinstance(obj, str)
 
 
-class MockResponse(object):
-    def __init__(self, build_json=None):
-        self.json = build_json
-
-    def get_annotations(self):
-        return graceful_chain_get(self.json, "metadata", "annotations")
-
-
-class BuildInfo(object):
-    def __init__(self, help_file=None, help_valid=True, media_types=None, digests=None):
-        self.annotations = {}
-        if media_types:
-            self.annotations['media-types'] = json.dumps(media_types)
-        if help_valid:
-            self.annotations['help_file'] = json.dumps(help_file)
-        if digests:
-            digest_annotation = []
-            for digest_item in digests:
-                digest_annotation_item = {
-                    "version": get_manifest_media_version(digest_item),
-                    "digest": digest_item.default,
-                }
-                digest_annotation.append(digest_annotation_item)
-            self.annotations['digests'] = json.dumps(digest_annotation)
-
-        self.build = MockResponse({'metadata': {'annotations': self.annotations}})
-
-
 def mock_reactor_config(workflow, allow_multiple_remote_sources=False):
     config = {'version': 1, 'koji': {'hub_url': '/',
                                      'root_url': '',
@@ -278,7 +424,6 @@ def mock_environment(workflow: DockerBuildWorkflow, source_dir: Path,
     workflow.data.plugins_results[PLUGIN_CHECK_AND_SET_PLATFORMS_KEY] = PLATFORMS
     workflow.data.plugins_results[PLUGIN_RESOLVE_COMPOSES_KEY] = {'composes': []}
 
-    mock_reactor_config(workflow)
     workflow.user_params['scratch'] = scratch
 
     if yum_repourls:
@@ -307,9 +452,9 @@ def mock_environment(workflow: DockerBuildWorkflow, source_dir: Path,
 
     tag_conf = workflow.data.tag_conf
     if name and version:
-        tag_conf.add_unique_image('{}:{}-timestamp'.format(name, version))
+        tag_conf.add_unique_image(f'{name}:{version}-timestamp')
     if name and version and release and add_tag_conf_primaries:
-        tag_conf.add_primary_image("{0}:{1}-{2}".format(name, version, release))
+        tag_conf.add_primary_image(f"{name}:{version}-{release}")
         tag_conf.add_floating_image(f"{name}:{version}")
         tag_conf.add_floating_image(f"{name}:latest")
     if additional_tags:
@@ -383,10 +528,9 @@ def mock_environment(workflow: DockerBuildWorkflow, source_dir: Path,
             digest_str = digest.oci
         else:
             digest_str = digest.v2
-        manifest_url = "https://{}/v2/{}/manifests/{}".format(REGISTRY, image.to_str(tag=False),
-                                                              digest_str)
-        config_blob_url = "https://{}/v2/{}/blobs/{}".format(REGISTRY, image.to_str(tag=False),
-                                                             digest_str)
+        repo = image.to_str(tag=False)
+        manifest_url = f"https://{REGISTRY}/v2/{repo}/manifests/{digest_str}"
+        config_blob_url = f"https://{REGISTRY}/v2/{repo}/blobs/{digest_str}"
 
         if has_config:
             config_json = {'config': {'architecture': 'x86_64'},
@@ -620,6 +764,19 @@ def workflow(workflow):
     return workflow
 
 
+@pytest.fixture
+def koji_env(workflow, source_dir):
+    """Return a factory mocking the environment for ns/name:1.0-1 and returning the session."""
+    def _koji_env(session=None, **kwargs):
+        if session is None:
+            session = MockedClientSession('')
+        kwargs = {'name': 'ns/name', 'version': '1.0', 'release': '1', **kwargs}
+        mock_environment(workflow, source_dir, session=session, **kwargs)
+        return session
+
+    return _koji_env
+
+
 @pytest.fixture
 def _os_env(monkeypatch):
     monkeypatch.setenv('OPENSHIFT_CUSTOM_BUILD_BASE_IMAGE', 'buildroot:latest')
@@ -652,7 +809,19 @@ def create_runner(workflow, ssl_certs=False, principal=None,
 
 @pytest.mark.usefixtures('user_params')
 class TestKojiImport(object):
-    def test_koji_import_get_buildroot(self, workflow, source_dir):
+    @pytest.fixture(autouse=True)
+    def _reactor_config(self, workflow):
+        mock_reactor_config(workflow)
+
+    @pytest.fixture
+    def koji_import_plugin(self, workflow, _reactor_config):
+        """KojiImportPlugin for tests which exercise its helpers rather than running it.
+
+        Depends on _reactor_config, the plugin reads the reactor config on creation.
+        """
+        return KojiImportPlugin(workflow)
+
+    def test_koji_import_get_buildroot(self, workflow, koji_env):
         metadatas = {
             'ppc64le': {
                 'buildroots': [
@@ -694,9 +863,7 @@ class TestKojiImport(object):
             },
         ]
 
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir, session=session, build_process_failed=True,
-                         name='ns/name', version='1.0', release='1')
+        koji_env(build_process_failed=True)
 
         add_koji_map_in_workflow(workflow, hub_url='')
         workflow.data.plugins_results[GatherBuildsMetadataPlugin.key] = metadatas
@@ -705,8 +872,8 @@ class TestKojiImport(object):
 
         assert plugin.get_buildroot() == results
 
-    def test_koji_import_no_build_metadata(self, workflow, source_dir):
-        mock_environment(workflow, source_dir, name='ns/name', version='1.0', release='1')
+    def test_koji_import_no_build_metadata(self, workflow, koji_env):
+        koji_env()
         runner = create_runner(workflow)
 
         # No metadata
@@ -715,9 +882,9 @@ class TestKojiImport(object):
         with pytest.raises(PluginFailedException):
             runner.run()
 
-    def test_koji_import_wrong_source_type(self, workflow, source_dir):
+    def test_koji_import_wrong_source_type(self, workflow, source_dir, koji_env):
         source = PathSource('path', f'file://{source_dir}')
-        mock_environment(workflow, source_dir, name='ns/name', version='1.0', release='1')
+        koji_env()
         runner = create_runner(workflow)
         setattr(workflow, 'source', source)
         with pytest.raises(PluginFailedException) as exc:
@@ -729,10 +896,8 @@ class TestKojiImport(object):
         True,
         None
     ])
-    def test_isolated_metadata_json(self, workflow, source_dir, isolated):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         session=session, name='ns/name', version='1.0', release='1')
+    def test_isolated_metadata_json(self, workflow, koji_env, isolated):
+        session = koji_env()
         runner = create_runner(workflow)
 
         if isolated is not None:
@@ -751,11 +916,8 @@ class TestKojiImport(object):
         {},
         {'custom': 'userdata'},
     ])
-    def test_userdata_metadata(self, workflow, source_dir, userdata):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         session=session, name='ns/name',
-                         version='1.0', release='1')
+    def test_userdata_metadata(self, workflow, koji_env, userdata):
+        session = koji_env()
         runner = create_runner(workflow, userdata=userdata)
 
         runner.run()
@@ -771,29 +933,23 @@ class TestKojiImport(object):
         (12345, True),
         ('x', False),
     ])
-    def test_koji_import_log_task_id(self, workflow, source_dir,
+    def test_koji_import_log_task_id(self, workflow, koji_env,
                                      caplog, koji_task_id, expect_success):
         session = MockedClientSession('')
         session.getTaskInfo = lambda x: {'owner': 1234, 'state': 1}
         setattr(session, 'getUser', lambda x: {'name': 'dev1'})
 
-        mock_environment(workflow, source_dir,
-                         session=session, name='ns/name', version='1.0', release='1')
+        koji_env(session=session)
         runner = create_runner(workflow)
 
         workflow.user_params['koji_task_id'] = koji_task_id
 
         runner.run()
         metadata = session.metadata
-        assert 'build' in metadata
-        build = metadata['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
+        extra = get_build_extra(metadata)
 
         if expect_success:
-            assert "Koji Task ID {}".format(koji_task_id) in caplog.text
+            assert f"Koji Task ID {koji_task_id}" in caplog.text
 
             assert 'container_koji_task_id' in extra
             extra_koji_task_id = extra['container_koji_task_id']
@@ -824,7 +980,7 @@ class TestKojiImport(object):
             'principal': None,
             'keytab': 'FILE:/var/run/secrets/mysecret',
         },
-    ])
+    ], ids=['no-credentials', 'principal-and-keytab', 'missing-keytab', 'missing-principal'])
     def test_koji_import_krb_args(self, workflow, source_dir, params):
         session = MockedClientSession('')
         expectation = flexmock(session).should_receive('krb_login').and_return(True)
@@ -845,26 +1001,24 @@ class TestKojiImport(object):
             expectation.once()
             runner.run()
 
-    def test_koji_import_krb_fail(self, workflow, source_dir):
+    def test_koji_import_krb_fail(self, workflow, koji_env):
         session = MockedClientSession('')
         (flexmock(session)
             .should_receive('krb_login')
             .and_raise(RuntimeError)
             .once())
-        mock_environment(workflow, source_dir,
-                         session=session, name='ns/name', version='1.0', release='1')
+        koji_env(session=session)
         runner = create_runner(workflow)
         with pytest.raises(PluginFailedException):
             runner.run()
 
-    def test_koji_import_ssl_fail(self, workflow, source_dir):
+    def test_koji_import_ssl_fail(self, workflow, koji_env):
         session = MockedClientSession('')
         (flexmock(session)
             .should_receive('ssl_login')
             .and_raise(RuntimeError)
             .once())
-        mock_environment(workflow, source_dir,
-                         session=session, name='ns/name', version='1.0', release='1')
+        koji_env(session=session)
         runner = create_runner(workflow, ssl_certs=True)
         with pytest.raises(PluginFailedException):
             runner.run()
@@ -887,7 +1041,7 @@ class TestKojiImport(object):
         assert len(components) > 0
         for component_rpm in components:
             assert isinstance(component_rpm, dict)
-            assert set(component_rpm.keys()) == {
+            assert component_rpm.keys() == {
                 'type',
                 'name',
                 'version',
@@ -913,7 +1067,7 @@ class TestKojiImport(object):
     def validate_buildroot(self, buildroot, source=False):
         assert isinstance(buildroot, dict)
 
-        assert set(buildroot.keys()) == {
+        assert buildroot.keys() == {
             'id',
             'host',
             'content_generator',
@@ -924,7 +1078,7 @@ class TestKojiImport(object):
 
         host = buildroot['host']
         assert isinstance(host, dict)
-        assert set(host.keys()) == {'os', 'arch'}
+        assert host.keys() == {'os', 'arch'}
 
 #        assert host['os']
 #        assert is_string_type(host['os'])
@@ -934,7 +1088,7 @@ class TestKojiImport(object):
 
         content_generator = buildroot['content_generator']
         assert isinstance(content_generator, dict)
-        assert set(content_generator.keys()) == {'name', 'version'}
+        assert content_generator.keys() == {'name', 'version'}
 
         assert content_generator['name']
         assert is_string_type(content_generator['name'])
@@ -943,7 +1097,7 @@ class TestKojiImport(object):
 
         container = buildroot['container']
         assert isinstance(container, dict)
-        assert set(container.keys()) == {'type', 'arch'}
+        assert container.keys() == {'type', 'arch'}
 
         assert container['type'] == 'none'
         assert container['arch']
@@ -965,7 +1119,7 @@ class TestKojiImport(object):
         assert is_string_type(output['checksum_type'])
         assert 'type' in output
         if output['type'] == 'log':
-            assert set(output.keys()) == {
+            assert output.keys() == {
                 'buildroot_id',
                 'filename',
                 'filesize',
@@ -976,7 +1130,7 @@ class TestKojiImport(object):
             }
             assert output['arch'] == 'noarch'
         elif output['type'] == KOJI_BTYPE_ICM:
-            assert set(output.keys()) == {
+            assert output.keys() == {
                 'buildroot_id',
                 'filename',
                 'filesize',
@@ -988,7 +1142,7 @@ class TestKojiImport(object):
             icm_files = [ICM_JSON_FILENAME.format(platform) for platform in PLATFORMS]
             assert output['filename'] in icm_files
         else:
-            assert set(output.keys()) == {
+            assert output.keys() == {
                 'buildroot_id',
                 'filename',
                 'filesize',
@@ -1010,11 +1164,11 @@ class TestKojiImport(object):
 
             extra = output['extra']
             assert isinstance(extra, dict)
-            assert set(extra.keys()) == {'image', 'docker'}
+            assert extra.keys() == {'image', 'docker'}
 
             image = extra['image']
             assert isinstance(image, dict)
-            assert set(image.keys()) == {'arch'}
+            assert image.keys() == {'arch'}
 
             assert image['arch'] == output['arch']  # what else?
 
@@ -1041,15 +1195,15 @@ class TestKojiImport(object):
             if has_config:
                 expected_keys_set.add('config')
 
-            assert set(docker.keys()) == expected_keys_set
+            assert docker.keys() == expected_keys_set
 
             if not source:
                 assert is_string_type(docker['parent_id'])
             assert is_string_type(docker['id'])
             repositories = docker['repositories']
             assert isinstance(repositories, list)
-            repositories_digest = list(filter(lambda repo: '@sha256' in repo, repositories))
-            assert sorted(repositories_digest) == sorted(set(repositories_digest))
+            repositories_digest = [repo for repo in repositories if '@sha256' in repo]
+            assert len(repositories_digest) == len(set(repositories_digest))
 
     def test_koji_import_import_fail(self, workflow, source_dir, caplog):
         session = MockedClientSession('')
@@ -1075,10 +1229,8 @@ class TestKojiImport(object):
         ('NO-RESULT', False, False),
     ])
     def test_koji_import_parent_id(self, parent_id, expect_success, expect_error,
-                                   workflow, source_dir, caplog):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+                                   workflow, koji_env, caplog):
+        session = koji_env()
 
         koji_parent_result = None
         if parent_id != 'NO-RESULT':
@@ -1091,12 +1243,7 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
+        extra = get_build_extra(data)
 
         if expect_error:
             assert 'invalid koji parent id' in caplog.text
@@ -1113,12 +1260,10 @@ class TestKojiImport(object):
 
     @pytest.mark.parametrize('base_from_scratch', [True, False])  # noqa: F811
     def test_produces_metadata_for_parent_images(
-        self, workflow, source_dir, base_from_scratch
+        self, workflow, koji_env, base_from_scratch
     ):
 
-        koji_session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         session=koji_session, name='ns/name', version='1.0', release='1')
+        koji_session = koji_env()
 
         koji_parent_result = {
             BASE_IMAGE_KOJI_BUILD: dict(id=16, extra='build info'),
@@ -1156,11 +1301,9 @@ class TestKojiImport(object):
         ('x', False),
     ])
     def test_koji_import_filesystem_koji_task_id(
-        self, task_id, expect_success, workflow, source_dir, caplog
+        self, task_id, expect_success, workflow, koji_env, caplog
     ):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+        session = koji_env()
         workflow.data.plugins_results[AddFilesystemPlugin.key] = {
             'base-image-id': 'abcd',
             'filesystem-koji-task-id': task_id,
@@ -1169,12 +1312,7 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
+        extra = get_build_extra(data)
 
         if expect_success:
             assert 'filesystem_koji_task_id' in extra
@@ -1186,11 +1324,9 @@ class TestKojiImport(object):
             assert 'filesystem_koji_task_id' not in extra
 
     def test_koji_import_filesystem_koji_task_id_missing(
-        self, workflow, source_dir, caplog
+        self, workflow, koji_env, caplog
     ):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+        session = koji_env()
         workflow.data.plugins_results[AddFilesystemPlugin.key] = {
             'base-image-id': 'abcd',
         }
@@ -1198,12 +1334,7 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
+        extra = get_build_extra(data)
         assert 'filesystem_koji_task_id' not in extra
         assert AddFilesystemPlugin.key in caplog.text
 
@@ -1233,72 +1364,41 @@ class TestKojiImport(object):
 
         if verify_media:
             workflow.data.plugins_results[PLUGIN_VERIFY_MEDIA_KEY] = verify_media
-        expected_media_types = verify_media or []
+        expected_media_types = sorted(verify_media or [])
 
         build_token = 'token_12345'
-        build_id = '123'
+        build_id = MockedClientSession.BUILD_ID
         if has_reserved_build:
             workflow.data.reserved_build_id = build_id
             workflow.data.reserved_token = build_token
 
-        if has_reserved_build:
-            (flexmock(session)
-                .should_call('CGImport')
-                .with_args(KOJI_METADATA_FILENAME, str, token=build_token)
-             )
-        else:
-            (flexmock(session)
-                .should_call('CGImport')
-                .with_args(KOJI_METADATA_FILENAME, str, token=None)
-             )
-
         target = 'images-docker-candidate'
         runner = create_runner(workflow, target=target, blocksize=blocksize)
         runner.run()
 
         if skip_import:
-            log_msg = "Koji task is not in Open state, but in {}, not importing build".\
-                format(task_states[0])
+            log_msg = (f"Koji task is not in Open state, but in {task_states[0]}, "
+                       "not importing build")
 
             assert log_msg in caplog.text
+            assert session.cgimport_calls == []
             return
 
-        data = session.metadata
+        (metadata_file, server_dir, token), = session.cgimport_calls
+        assert metadata_file == KOJI_METADATA_FILENAME
+        assert isinstance(server_dir, str)
+        assert token == (build_token if has_reserved_build else None)
 
-        assert set(data.keys()) == {
-            'metadata_version',
-            'build',
-            'buildroots',
-            'output',
-        }
-
-        assert data['metadata_version'] in ['0', 0]
+        data = session.metadata
+        koji_import_metadata_validator.validate(data)
+        extra = get_build_extra(data)
 
         build = data['build']
-        assert isinstance(build, dict)
-
         buildroots = data['buildroots']
-        assert isinstance(buildroots, list)
-        assert len(buildroots) > 0
-
         output_files = data['output']
-        assert isinstance(output_files, list)
-
-        expected_keys = {
-            'name',
-            'version',
-            'release',
-            'source',
-            'start_time',
-            'end_time',
-            'extra',          # optional but always supplied
-            'owner',
-        }
 
-        if has_reserved_build:
-            expected_keys.add('build_id')
-
-        assert set(build.keys()) == expected_keys
+        expected_keys = KOJI_RESERVED_BUILD_KEYS if has_reserved_build else KOJI_BUILD_KEYS
+        assert build.keys() == expected_keys
 
         if has_reserved_build:
             assert build['build_id'] == build_id
@@ -1306,20 +1406,11 @@ class TestKojiImport(object):
         assert build['version'] == version
         assert build['release'] == release
         assert build['source'] == 'git://hostname/path#123456'
-        start_time = build['start_time']
-        assert isinstance(start_time, int) and start_time
-        end_time = build['end_time']
-        assert isinstance(end_time, int) and end_time
+        assert isinstance(build['start_time'], int)
+        assert isinstance(build['end_time'], int)
 
-        extra = build['extra']
-        assert isinstance(extra, dict)
-
-        assert 'osbs_build' in extra
         osbs_build = extra['osbs_build']
-        assert isinstance(osbs_build, dict)
-        assert 'kind' in osbs_build
         assert osbs_build['kind'] == KOJI_KIND_IMAGE_BUILD
-        assert 'subtypes' in osbs_build
         assert osbs_build['subtypes'] == []
         assert 'engine' in osbs_build
         assert osbs_build['engine'] == 'podman'
@@ -1331,52 +1422,43 @@ class TestKojiImport(object):
         archives = [ICM_JSON_FILENAME.format(platform) for platform in PLATFORMS]
         assert icm_typeinfo == {'archives': archives, 'name': KOJI_BTYPE_ICM}
 
-        assert 'image' in extra
         image = extra['image']
-        assert isinstance(image, dict)
 
         if expected_media_types:
             media_types = image['media_types']
             assert isinstance(media_types, list)
-            assert sorted(media_types) == sorted(expected_media_types)
+            assert sorted(media_types) == expected_media_types
 
-        for buildroot in buildroots:
+        buildroots_by_id = {buildroot['id']: buildroot for buildroot in buildroots}
+        # Unique within buildroots in this metadata
+        assert len(buildroots_by_id) == len(buildroots)
+        for buildroot in buildroots_by_id.values():
             self.validate_buildroot(buildroot)
 
-            # Unique within buildroots in this metadata
-            assert len([b for b in buildroots
-                        if b['id'] == buildroot['id']]) == 1
-
         for output in output_files:
             self.validate_output(output, False)
-            buildroot_id = output['buildroot_id']
 
             # References one of the buildroots
-            assert len([buildroot for buildroot in buildroots
-                        if buildroot['id'] == buildroot_id]) == 1
+            assert output['buildroot_id'] in buildroots_by_id
 
-        build_id = runner.plugins_results[KojiImportPlugin.key]
-        assert build_id == "123"
+        assert runner.plugins_results[KojiImportPlugin.key] == build_id
 
         expected_files = {
-            OSBS_BUILD_LOG_FILENAME,
-            KOJI_METADATA_FILENAME,
+            OSBS_BUILD_LOG_FILENAME: OSBS_BUILD_LOG,
+            KOJI_METADATA_FILENAME: ANY,
         }
         for platform in PLATFORMS:
-            expected_files.add(ICM_JSON_FILENAME.format(platform))
+            expected_files[ICM_JSON_FILENAME.format(platform)] = ANY
 
-        assert set(session.uploaded_files.keys()) == expected_files
-        osbs_build_log = session.uploaded_files[OSBS_BUILD_LOG_FILENAME]
-        assert osbs_build_log == b"log message A\nlog message B\nlog message C\n"
-        assert workflow.data.annotations['koji-build-id'] == '123'
+        assert session.uploaded_files == expected_files
+        assert workflow.data.annotations['koji-build-id'] == build_id
 
-    def test_koji_import_owner_submitter(self, workflow, source_dir):
+    def test_koji_import_owner_submitter(self, workflow, koji_env):
         session = MockedClientSession('')
         session.getTaskInfo = lambda x: {'owner': 1234, 'state': 1}
         setattr(session, 'getUser', lambda x: {'name': 'dev1'})
 
-        mock_environment(workflow, source_dir,
-                         session=session, name='ns/name', version='1.0', release='1')
+        koji_env(session=session)
         runner = create_runner(workflow)
         workflow.user_params['koji_task_id'] = 1234
 
@@ -1447,11 +1529,9 @@ class TestKojiImport(object):
         [{AddHelpPlugin.key: {}}, None],
         [{AddHelpPlugin.key: {'help_file': None}}, None],
         [{AddHelpPlugin.key: {'help_file': 'help.md'}}, 'help.md'],
-    ])
-    def test_koji_import_add_help(self, add_help_results, expected_help_file, workflow, source_dir):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+    ], ids=['no-result', 'empty-result', 'no-help-file', 'help-file'])
+    def test_koji_import_add_help(self, add_help_results, expected_help_file, workflow, koji_env):
+        session = koji_env()
         workflow.data.plugins_results.update(add_help_results)
 
         runner = create_runner(workflow)
@@ -1467,11 +1547,9 @@ class TestKojiImport(object):
 
     @pytest.mark.skipif(not MODULEMD_AVAILABLE,
                         reason="libmodulemd not available")
-    def test_koji_import_flatpak(self, workflow, source_dir):
+    def test_koji_import_flatpak(self, workflow, koji_env):
         workflow.user_params['flatpak'] = True
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+        session = koji_env()
 
         setup_flatpak_composes(workflow)
         (flexmock(FlatpakUtil)
@@ -1482,15 +1560,8 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
-        assert 'image' in extra
+        extra = get_build_extra(data)
         image = extra['image']
-        assert isinstance(image, dict)
         assert 'osbs_build' in extra
         osbs_build = extra['osbs_build']
         assert osbs_build['subtypes'] == ['flatpak']
@@ -1512,13 +1583,11 @@ class TestKojiImport(object):
             {PLUGIN_VERIFY_MEDIA_KEY: [MEDIA_TYPE_DOCKER_V2_SCHEMA2]},
             [MEDIA_TYPE_DOCKER_V2_SCHEMA2],
         ],
-    ])
+    ], ids=['no-result', 'no-media-types', 'v2-schema2'])
     def test_koji_import_set_media_types(
-        self, workflow, source_dir, build_result, expected
+        self, workflow, koji_env, build_result, expected
     ):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+        session = koji_env()
         workflow.data.plugins_results.update(build_result)
 
         runner = create_runner(workflow)
@@ -1531,6 +1600,7 @@ class TestKojiImport(object):
         else:
             assert expected == image['media_types']
 
+    @pytest.mark.slow
     @pytest.mark.parametrize('is_scratch', [True, False])
     @pytest.mark.parametrize('digest', [
         None,
@@ -1542,7 +1612,7 @@ class TestKojiImport(object):
         version = '1.0'
         release = '1'
         name = 'ns/name'
-        unique_tag = "{}-timestamp".format(version)
+        unique_tag = f"{version}-timestamp"
         mock_environment(workflow, source_dir,
                          name=name, version=version, release=release,
                          session=session, add_tag_conf_primaries=not is_scratch, scratch=is_scratch)
@@ -1554,36 +1624,30 @@ class TestKojiImport(object):
             }
         workflow.data.plugins_results[PLUGIN_GROUP_MANIFESTS_KEY] = group_manifest_result
 
-        flexmock(koji_cli.lib).should_receive('unique_path').and_return('upload-dir')
+        flexmock(koji_cli.lib).should_receive('unique_path').and_return(KOJI_UPLOAD_DIR)
 
         runner = create_runner(workflow)
         runner.run()
 
         if is_scratch:
             medata_tag = 'platform:_metadata_'
-            metadata_file = KOJI_METADATA_FILENAME
-            assert metadata_file in session.uploaded_files
-            data = json.loads(session.uploaded_files[metadata_file])
+            assert KOJI_METADATA_FILENAME in session.uploaded_files
+            data = json.loads(session.uploaded_files[KOJI_METADATA_FILENAME])
 
+            # metadata is uploaded at the very end of the run, look for its
+            # record from the latest one
             meta_record = ''
-            for rec in caplog.records:
-                if medata_tag in rec.message:
-                    _, meta_record = rec.message.rsplit(' ', 1)
+            for rec in reversed(caplog.get_records('call')):
+                if medata_tag in rec.getMessage():
+                    _, meta_record = rec.getMessage().rsplit(' ', 1)
                     break
 
-            assert os.path.join('upload-dir', metadata_file) == meta_record
+            assert KOJI_METADATA_UPLOAD_PATH == meta_record
         else:
             data = session.metadata
 
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
-        assert 'image' in extra
+        extra = get_build_extra(data)
         image = extra['image']
-        assert isinstance(image, dict)
         expected_results = {'unique_tags': [unique_tag]}
         expected_results['floating_tags'] = [
             tag.tag for tag in workflow.data.tag_conf.floating_images
@@ -1597,18 +1661,15 @@ class TestKojiImport(object):
                 tag.tag for tag in workflow.data.tag_conf.primary_images
             ]
 
-        for tag in expected_results['tags']:
-            if '-' in tag:
-                version_release = tag
-                break
-        else:
-            raise RuntimeError("incorrect test data")
+        # scratch builds have no primary tags, the unique tag is used instead
+        version_release = unique_tag if is_scratch else f"{version}-{release}"
+        assert version_release in expected_results['tags'], "incorrect test data"
 
         if digest:
             assert 'index' in image.keys()
-            pullspec = "{}/{}@{}".format(REGISTRY, name, digest.v2_list)
+            pullspec = f"{REGISTRY}/{name}@{digest.v2_list}"
             expected_results['pull'] = [pullspec]
-            pullspec = "{}/{}:{}".format(REGISTRY, name, version_release)
+            pullspec = f"{REGISTRY}/{name}:{version_release}"
             expected_results['pull'].append(pullspec)
             expected_results['digests'] = {
                 'application/vnd.docker.distribution.manifest.list.v2+json': digest.v2_list}
@@ -1616,6 +1677,9 @@ class TestKojiImport(object):
         else:
             assert 'index' not in image.keys()
             assert 'output' in data
+            expected_tags = Counter(expected_results['tags'])
+            expected_floating_tags = Counter(expected_results['floating_tags'])
+            expected_unique_tags = Counter(expected_results['unique_tags'])
             for output in data['output']:
                 if output['type'] in ('log', KOJI_BTYPE_ICM):
                     continue
@@ -1625,17 +1689,15 @@ class TestKojiImport(object):
                 assert 'tags' in extra['docker']
                 assert 'floating_tags' in extra['docker']
                 assert 'unique_tags' in extra['docker']
-                assert sorted(expected_results['tags']) == sorted(extra['docker']['tags'])
-                assert (sorted(expected_results['floating_tags']) ==
-                        sorted(extra['docker']['floating_tags']))
-                assert (sorted(expected_results['unique_tags']) ==
-                        sorted(extra['docker']['unique_tags']))
+                assert Counter(extra['docker']['tags']) == expected_tags
+                assert Counter(extra['docker']['floating_tags']) == expected_floating_tags
+                assert Counter(extra['docker']['unique_tags']) == expected_unique_tags
                 repositories = extra['docker']['repositories']
                 assert len(repositories) == 2
-                assert len([pullspec for pullspec in repositories
-                            if '@' in pullspec]) == 1
-                by_tags = [pullspec for pullspec in repositories
-                           if '@' not in pullspec]
+                by_digests, by_tags = [], []
+                for pullspec in repositories:
+                    (by_digests if '@' in pullspec else by_tags).append(pullspec)
+                assert len(by_digests) == 1
                 assert len(by_tags) == 1
                 by_tag = by_tags[0]
 
@@ -1643,19 +1705,15 @@ class TestKojiImport(object):
                 # following registry. In real uses this would really
                 # be a Crane registry URI.
                 registry = 'docker-registry.example.com:8888'
-                assert by_tag == '%s/myproject/hello-world:%s' % (registry,
-                                                                  version_release)
+                assert by_tag == f'{registry}/myproject/hello-world:{version_release}'
 
     @pytest.mark.parametrize(('add_tag_conf_primaries', 'success'), (
         (False, False),
         (True, True),
     ))
-    def test_koji_import_primary_images(self, workflow, source_dir,
+    def test_koji_import_primary_images(self, workflow, koji_env,
                                         add_tag_conf_primaries, success):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         add_tag_conf_primaries=add_tag_conf_primaries, session=session)
+        koji_env(add_tag_conf_primaries=add_tag_conf_primaries)
 
         runner = create_runner(workflow)
 
@@ -1674,10 +1732,8 @@ class TestKojiImport(object):
         ([{'id': 4}, {'id': 5}, {'id': 6}], "release", False),
         (None, None, None)
     ])
-    def test_odcs_metadata_koji(self, workflow, source_dir, comp, sign_int, override):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+    def test_odcs_metadata_koji(self, workflow, koji_env, comp, sign_int, override):
+        session = koji_env()
 
         workflow.data.plugins_results[PLUGIN_RESOLVE_COMPOSES_KEY] = {
             'composes': comp,
@@ -1691,15 +1747,8 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
-        assert 'image' in extra
+        extra = get_build_extra(data)
         image = extra['image']
-        assert isinstance(image, dict)
 
         if comp:
             comp_ids = [item['id'] for item in comp]
@@ -1716,10 +1765,8 @@ class TestKojiImport(object):
         True,
         False,
     ])
-    def test_odcs_metadata_koji_plugin_run(self, workflow, source_dir, resolve_run):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1', session=session)
+    def test_odcs_metadata_koji_plugin_run(self, workflow, koji_env, resolve_run):
+        session = koji_env()
 
         if resolve_run:
             workflow.data.plugins_results[PLUGIN_RESOLVE_COMPOSES_KEY] = {'composes': []}
@@ -1728,108 +1775,70 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
-        assert 'image' in extra
+        extra = get_build_extra(data)
         image = extra['image']
-        assert isinstance(image, dict)
         assert 'odcs' not in image
 
-    @pytest.mark.parametrize('container_first', [True, False])
-    def test_go_metadata(self, workflow, source_dir, container_first):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session, container_first=container_first)
-
-        runner = create_runner(workflow)
-        runner.run()
-
-        data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
-        assert 'image' in extra
-        image = extra['image']
-        assert isinstance(image, dict)
-        if container_first:
-            assert 'go' in image
-            go = image['go']
-            assert isinstance(go, dict)
-            assert 'modules' in go
-            modules = go['modules']
-            assert isinstance(modules, list)
-            assert len(modules) == 1
-            module = modules[0]
-            assert module['module'] == 'example.com/packagename'
-        else:
-            assert 'go' not in image
-
-    @pytest.mark.parametrize('yum_repourl', [
-        None,
-        [],
-        ["http://example.com/my.repo", ],
-        ["http://example.com/my.repo", "http://example.com/other.repo"],
+    @pytest.mark.parametrize(('env_kwargs', 'key', 'expected'), [
+        pytest.param({'container_first': False}, 'go', None, id='go-none'),
+        pytest.param(
+            {'container_first': True},
+            'go',
+            {'modules': [{'module': 'example.com/packagename'}]},
+            id='go-modules',
+        ),
+        pytest.param({'yum_repourls': None}, 'yum_repourls', None, id='yum-none'),
+        pytest.param({'yum_repourls': []}, 'yum_repourls', None, id='yum-empty'),
+        pytest.param(
+            {'yum_repourls': ["http://example.com/my.repo"]},
+            'yum_repourls',
+            ["http://example.com/my.repo"],
+            id='yum-one',
+        ),
+        pytest.param(
+            {'yum_repourls': ["http://example.com/my.repo", "http://example.com/other.repo"]},
+            'yum_repourls',
+            ["http://example.com/my.repo", "http://example.com/other.repo"],
+            id='yum-multiple',
+        ),
+        pytest.param({'has_pnc_build_metadata': False}, 'pnc', None, id='pnc-none'),
+        pytest.param(
+            {'has_pnc_build_metadata': True},
+            'pnc',
+            {'builds': [{'id': 12345}, {'id': 12346}]},
+            id='pnc-builds',
+        ),
     ])
-    def test_yum_repourls_metadata(self, workflow, source_dir, yum_repourl):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session, yum_repourls=yum_repourl)
+    def test_image_metadata(self, workflow, koji_env, env_kwargs, key, expected):
+        session = koji_env(**env_kwargs)
 
         runner = create_runner(workflow)
         runner.run()
 
-        data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
-        assert 'image' in extra
-        image = extra['image']
-        assert isinstance(image, dict)
-        if yum_repourl:
-            assert 'yum_repourls' in image
-            repourls = image['yum_repourls']
-            assert isinstance(repourls, list)
-            assert repourls == yum_repourl
+        image = get_build_extra(session.metadata)['image']
+        if expected is None:
+            assert key not in image
         else:
-            assert 'yum_repourls' not in image
+            assert image[key] == expected
 
     @pytest.mark.parametrize('has_appregistry_manifests', [True, False])
     @pytest.mark.parametrize('has_bundle_manifests', [True, False])
     @pytest.mark.parametrize('push_operator_manifests', [True, False])
     def test_set_operators_metadata(
-            self, workflow, source_dir,
+            self, workflow, koji_env,
             has_appregistry_manifests, has_bundle_manifests,
             push_operator_manifests):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session,
-                         has_op_appregistry_manifests=has_appregistry_manifests,
-                         has_op_bundle_manifests=has_bundle_manifests,
-                         push_operator_manifests_enabled=push_operator_manifests)
+        session = koji_env(
+            has_op_appregistry_manifests=has_appregistry_manifests,
+            has_op_bundle_manifests=has_bundle_manifests,
+            push_operator_manifests_enabled=push_operator_manifests,
+        )
         runner = create_runner(workflow)
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
+        extra = get_build_extra(data)
 
-        assert isinstance(extra, dict)
         assert 'osbs_build' in extra
         assert 'typeinfo' in extra
         osbs_build = extra['osbs_build']
@@ -1862,13 +1871,10 @@ class TestKojiImport(object):
     @pytest.mark.usefixtures('_os_env')
     @pytest.mark.parametrize('has_bundle_manifests', [True, False])
     def test_operators_bundle_metadata(
-            self, workflow, source_dir, has_bundle_manifests):
+            self, workflow, koji_env, has_bundle_manifests):
         """Test if metadata (extra.image.operator_manifests) about operator
         bundles are properly exported"""
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session, has_op_bundle_manifests=has_bundle_manifests)
+        session = koji_env(has_op_bundle_manifests=has_bundle_manifests)
 
         if has_bundle_manifests:
             workflow.data.plugins_results[PLUGIN_PIN_OPERATOR_DIGESTS_KEY] = {
@@ -1901,13 +1907,8 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
+        extra = get_build_extra(data)
 
-        assert isinstance(extra, dict)
         if has_bundle_manifests:
             assert 'operator_manifests' in extra['image']
             expected = {
@@ -1938,13 +1939,10 @@ class TestKojiImport(object):
     @pytest.mark.usefixtures('_os_env')
     @pytest.mark.parametrize('has_op_csv_modifications', [True, False])
     def test_operators_bundle_metadata_csv_modifications(
-            self, workflow, source_dir, has_op_csv_modifications):
+            self, workflow, koji_env, has_op_csv_modifications):
         """Test if metadata (extra.image.operator_manifests.custom_csv_modifications_applied)
         about operator bundles are properly exported"""
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session, has_op_bundle_manifests=True)
+        session = koji_env(has_op_bundle_manifests=True)
 
         plugin_res = {
             'custom_csv_modifications_applied': has_op_csv_modifications,
@@ -1959,13 +1957,8 @@ class TestKojiImport(object):
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
+        extra = get_build_extra(data)
 
-        assert isinstance(extra, dict)
         assert 'operator_manifests' in extra['image']
         expected = {
             'custom_csv_modifications_applied': has_op_csv_modifications,
@@ -1979,25 +1972,17 @@ class TestKojiImport(object):
 
     @pytest.mark.parametrize('has_remote_source', [True, False])
     @pytest.mark.parametrize('allow_multiple_remote_sources', [True, False])
-    def test_remote_sources(self, workflow, source_dir,
+    def test_remote_sources(self, workflow, koji_env,
                             has_remote_source, allow_multiple_remote_sources):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session, has_remote_source=has_remote_source)
+        session = koji_env(has_remote_source=has_remote_source)
         mock_reactor_config(workflow, allow_multiple_remote_sources)
 
         runner = create_runner(workflow)
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
+        extra = get_build_extra(data)
         assert 'typeinfo' in extra
-        assert isinstance(extra, dict)
         # https://github.com/PyCQA/pylint/issues/2186
         # pylint: disable=W1655
         if has_remote_source:
@@ -2038,23 +2023,15 @@ class TestKojiImport(object):
             assert REMOTE_SOURCE_JSON_FILENAME not in session.uploaded_files.keys()
 
     @pytest.mark.parametrize('has_remote_source_file', [True, False])
-    def test_remote_source_files(self, workflow, source_dir, has_remote_source_file):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session, has_remote_source_file=has_remote_source_file)
+    def test_remote_source_files(self, workflow, koji_env, has_remote_source_file):
+        session = koji_env(has_remote_source_file=has_remote_source_file)
 
         runner = create_runner(workflow)
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
+        extra = get_build_extra(data)
         assert 'typeinfo' in extra
-        assert isinstance(extra, dict)
         # https://github.com/PyCQA/pylint/issues/2186
         # pylint: disable=W1655
         if has_remote_source_file:
@@ -2063,33 +2040,7 @@ class TestKojiImport(object):
         else:
             assert REMOTE_SOURCE_FILE_FILENAME not in session.uploaded_files.keys()
 
-    @pytest.mark.parametrize('has_pnc_build_metadata', [True, False])
-    def test_pnc_build_metadata(self, workflow, source_dir, has_pnc_build_metadata):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         name='ns/name', version='1.0', release='1',
-                         session=session, has_pnc_build_metadata=has_pnc_build_metadata)
-
-        runner = create_runner(workflow)
-        runner.run()
-
-        data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
-        assert isinstance(extra, dict)
-        # https://github.com/PyCQA/pylint/issues/2186
-        # pylint: disable=W1655
-        if has_pnc_build_metadata:
-            assert 'pnc' in extra['image']
-            assert 'builds' in extra['image']['pnc']
-            for build in extra['image']['pnc']['builds']:
-                assert 'id' in build
-        else:
-            assert 'pnc' not in extra['image']
-
+    @pytest.mark.slow
     @pytest.mark.parametrize('blocksize', (None, 1048576))
     @pytest.mark.parametrize(('has_config', 'oci'), ((True, False), (False, True)))
     @pytest.mark.parametrize(('verify_media', 'expect_id'), (
@@ -2129,25 +2080,14 @@ class TestKojiImport(object):
 
         if verify_media:
             workflow.data.plugins_results[PLUGIN_VERIFY_MEDIA_KEY] = verify_media
-        expected_media_types = verify_media or []
+        expected_media_types = sorted(verify_media or [])
 
         build_token = 'token_12345'
-        build_id = '123'
+        build_id = MockedClientSession.BUILD_ID
         if has_reserved_build:
             workflow.data.reserved_build_id = build_id
             workflow.data.reserved_token = build_token
 
-        if has_reserved_build:
-            (flexmock(session)
-                .should_call('CGImport')
-                .with_args(KOJI_METADATA_FILENAME, str, token=build_token)
-             )
-        else:
-            (flexmock(session)
-                .should_call('CGImport')
-                .with_args(KOJI_METADATA_FILENAME, str, token=None)
-             )
-
         target = 'images-docker-candidate'
         source_manifest = {
             'config': {
@@ -2168,48 +2108,28 @@ class TestKojiImport(object):
         runner.run()
 
         if skip_import:
-            log_msg = "Koji task is not in Open state, but in {}, not importing build".\
-                format(task_states[0])
+            log_msg = (f"Koji task is not in Open state, but in {task_states[0]}, "
+                       "not importing build")
 
             assert log_msg in caplog.text
+            assert session.cgimport_calls == []
             return
 
-        data = session.metadata
-
-        assert set(data.keys()) == {
-            'metadata_version',
-            'build',
-            'buildroots',
-            'output',
-        }
+        (metadata_file, server_dir, token), = session.cgimport_calls
+        assert metadata_file == KOJI_METADATA_FILENAME
+        assert isinstance(server_dir, str)
+        assert token == (build_token if has_reserved_build else None)
 
-        assert data['metadata_version'] in ['0', 0]
+        data = session.metadata
+        koji_import_metadata_validator.validate(data)
+        extra = get_build_extra(data)
 
         build = data['build']
-        assert isinstance(build, dict)
-
         buildroots = data['buildroots']
-        assert isinstance(buildroots, list)
-        assert len(buildroots) > 0
-
         output_files = data['output']
-        assert isinstance(output_files, list)
-
-        expected_keys = {
-            'name',
-            'version',
-            'release',
-            'source',
-            'start_time',
-            'end_time',
-            'extra',          # optional but always supplied
-            'owner',
-        }
-
-        if has_reserved_build:
-            expected_keys.add('build_id')
 
-        assert set(build.keys()) == expected_keys
+        expected_keys = KOJI_RESERVED_BUILD_KEYS if has_reserved_build else KOJI_BUILD_KEYS
+        assert build.keys() == expected_keys
 
         if has_reserved_build:
             assert build['build_id'] == build_id
@@ -2217,32 +2137,21 @@ class TestKojiImport(object):
         assert build['version'] == version
         assert build['release'] == release
         assert build['source'] == 'git://hostname/path#123456'
-        start_time = build['start_time']
-        assert isinstance(start_time, int) and start_time
-        end_time = build['end_time']
-        assert isinstance(end_time, int) and end_time
-
-        extra = build['extra']
-        assert isinstance(extra, dict)
+        assert isinstance(build['start_time'], int)
+        assert isinstance(build['end_time'], int)
 
         if userdata:
             assert extra['custom_user_metadata'] == userdata
         else:
             assert 'custom_user_metadata' not in extra
 
-        assert 'osbs_build' in extra
         osbs_build = extra['osbs_build']
-        assert isinstance(osbs_build, dict)
-        assert 'kind' in osbs_build
         assert osbs_build['kind'] == KOJI_KIND_IMAGE_SOURCE_BUILD
-        assert 'subtypes' in osbs_build
         assert osbs_build['subtypes'] == []
         assert 'engine' in osbs_build
         assert osbs_build['engine'] == KOJI_SOURCE_ENGINE
 
-        assert 'image' in extra
         image = extra['image']
-        assert isinstance(image, dict)
 
         assert image['sources_for_nvr'] == SOURCES_FOR_KOJI_NVR
         assert image['sources_signing_intent'] == SOURCES_SIGNING_INTENT
@@ -2250,202 +2159,67 @@ class TestKojiImport(object):
         if expected_media_types:
             media_types = image['media_types']
             assert isinstance(media_types, list)
-            assert sorted(media_types) == sorted(expected_media_types)
+            assert sorted(media_types) == expected_media_types
 
-        for buildroot in buildroots:
+        buildroots_by_id = {buildroot['id']: buildroot for buildroot in buildroots}
+        # Unique within buildroots in this metadata
+        assert len(buildroots_by_id) == len(buildroots)
+        for buildroot in buildroots_by_id.values():
             self.validate_buildroot(buildroot, source=True)
 
-            # Unique within buildroots in this metadata
-            assert len([b for b in buildroots
-                        if b['id'] == buildroot['id']]) == 1
-
         for output in output_files:
             self.validate_output(output, has_config, source=True)
-            buildroot_id = output['buildroot_id']
 
             # References one of the buildroots
-            assert len([buildroot for buildroot in buildroots
-                        if buildroot['id'] == buildroot_id]) == 1
+            assert output['buildroot_id'] in buildroots_by_id
 
-        build_id = runner.plugins_results[KojiImportSourceContainerPlugin.key]
-        assert build_id == "123"
+        assert runner.plugins_results[KojiImportSourceContainerPlugin.key] == build_id
 
-        uploaded_filename = 'docker-image-{}.{}.tar.gz'.format(expect_id, os.uname()[4])
-        assert set(session.uploaded_files.keys()) == {
-            OSBS_BUILD_LOG_FILENAME,
-            uploaded_filename,
-            KOJI_METADATA_FILENAME
+        uploaded_filename = f'docker-image-{expect_id}.{MACHINE}.tar.gz'
+        assert session.uploaded_files == {
+            OSBS_BUILD_LOG_FILENAME: OSBS_BUILD_LOG,
+            uploaded_filename: ANY,
+            KOJI_METADATA_FILENAME: ANY,
         }
-        osbs_build_log = session.uploaded_files[OSBS_BUILD_LOG_FILENAME]
-        assert osbs_build_log == b"log message A\nlog message B\nlog message C\n"
-
-        assert workflow.data.annotations['koji-build-id'] == '123'
-
-    @pytest.mark.parametrize('build_metadatas,platform,_filter,expected', [
-        [{}, None, None, []],
-        [{}, None, {}, []],
-        [{}, None, {"type": "docker-image"}, []],
-        [{"x86_64": {"output": []}}, None, {"type": "docker-image"}, []],
-        # No output is found by non-existing type.
-        [{"x86_64": {"output": [{"type": "log"}]}}, None, {"type": "docker-image"}, []],
-        # No output is found by unknown key.
-        [{"x86_64": {"output": [{"type": "log"}]}}, None, {"filename": "file.tar.gz"}, []],
-        [
-            {"x86_64": {"output": [{"type": "log"}]}},
-            None,
-            {"type": "log", "filename": "file.tar.gz"},
-            [],
-        ],
-        # Output is found by type.
-        [
-            {"x86_64": {"output": [{"type": "log"}, {"type": "docker-image"}]}},
-            None,
-            {"type": "docker-image"},
-            [("x86_64", {"type": "docker-image"})],
-        ],
-        # No output is found with multiple filters.
-        [
-            {
-                "x86_64": {
-                    "output": [
-                        {"type": "log", "filename": "build.log"},
-                        {"type": "docker-image", "filename": "img.tar.gz"},
-                    ],
-                },
-            },
-            None,
-            {"type": "docker-image", "filename": "img-file"},
-            [],
-        ],
-        # Find out output with multiple filters
-        [
-            {
-                "x86_64": {
-                    "output": [
-                        {"type": "log", "filename": "build.log"},
-                        {"type": "docker-image", "filename": "img.tar.gz"},
-                    ],
-                },
-            },
-            None,
-            {"type": "docker-image", "filename": "img.tar.gz"},
-            [("x86_64", {"type": "docker-image", "filename": "img.tar.gz"})],
-        ],
-        # No output if platform does not exist.
-        [{"x86_64": {"output": [{"type": "log", "filename": "build.log"}]}}, "s390x", None, []],
-        # Filter outputs by platform
-        [
-            {"x86_64": {"output": [{"type": "log", "filename": "build.log"}]}},
-            "x86_64",
-            None,
-            [("x86_64", {"type": "log", "filename": "build.log"})],
-        ],
-        # Filter outputs by combination of platform and filter
-        [
-            {
-                "x86_64": {
-                    "output": [
-                        {"type": "log", "filename": "build.log"},
-                        {"type": "docker-image", "filename": "img.tar.gz"},
-                    ],
-                },
-            },
-            "x86_64",
-            {"type": "docker-image"},
-            [("x86_64", {"type": "docker-image", "filename": "img.tar.gz"})],
-        ],
-        # Iterator outputs from multiple platforms
-        [
-            {
-                "x86_64": {
-                    "output": [
-                        {"type": "log", "filename": "build.log"},
-                        {"type": "docker-image", "filename": "img.tar.gz"},
-                    ],
-                },
-                "s390x": {
-                    "output": [
-                        {"type": "log", "filename": "build.log"},
-                        {"type": "docker-image", "filename": "img.tar.gz"},
-                    ],
-                },
-            },
-            None,
-            {"type": "docker-image"},
-            [
-                ("x86_64", {"type": "docker-image", "filename": "img.tar.gz"}),
-                ("s390x", {"type": "docker-image", "filename": "img.tar.gz"}),
-            ],
-        ],
-        [
-            {
-                "x86_64": {
-                    "output": [
-                        {"type": "log", "filename": "build.log"},
-                        {"type": "docker-image", "filename": "img.tar.gz"},
-                    ],
-                },
-                "s390x": {
-                    # s390x will not be included since no output in docker-image type.
-                    "output": [{"type": "log", "filename": "build.log"}],
-                },
-            },
-            None,
-            {"type": "docker-image"},
-            [("x86_64", {"type": "docker-image", "filename": "img.tar.gz"})],
-        ],
-    ])
+
+        assert workflow.data.annotations['koji-build-id'] == build_id
+
+    @pytest.mark.parametrize('build_metadatas,platform,_filter,expected',
+                             BUILD_METADATA_OUTPUTS_CASES)
     def test_iter_build_metadata_outputs(
-        self, build_metadatas, platform, _filter, expected, workflow
+        self, build_metadatas, platform, _filter, expected, workflow, koji_import_plugin
     ):
-        mock_reactor_config(workflow)
         workflow.data.plugins_results[GatherBuildsMetadataPlugin.key] = build_metadatas
 
-        plugin = KojiImportPlugin(workflow)
-        outputs = list(plugin._iter_build_metadata_outputs(platform, _filter=_filter))
+        outputs = list(koji_import_plugin._iter_build_metadata_outputs(platform, _filter=_filter))
         assert expected == outputs
 
-    @pytest.mark.parametrize("fs_result,expected,log", [
-        [None, None, None],
-        [{}, None, "expected filesystem-koji-task-id in result"],
-        [{"other-result": 1234}, None, "expected filesystem-koji-task-id in result"],
-        [{"filesystem-koji-task-id": "task_id"}, None, f"invalid task ID {'task_id'!r}"],
-        [{"filesystem-koji-task-id": 1}, 1, None],
-        [{"filesystem-koji-task-id": "1"}, 1, None],
-    ])
-    def test_property_filesystem_koji_task_id(self, fs_result, expected, log, workflow, caplog):
-        mock_reactor_config(workflow)
+    @pytest.mark.parametrize("fs_result,expected,log", FILESYSTEM_KOJI_TASK_ID_CASES)
+    def test_property_filesystem_koji_task_id(self, fs_result, expected, log, workflow, caplog,
+                                              koji_import_plugin):
         workflow.data.plugins_results[PLUGIN_ADD_FILESYSTEM_KEY] = fs_result
 
-        plugin = KojiImportPlugin(workflow)
-        assert expected == plugin._filesystem_koji_task_id
+        assert expected == koji_import_plugin._filesystem_koji_task_id
 
         if log is not None:
-            assert log in caplog.text
+            assert any(log in rec.getMessage() for rec in caplog.records)
 
     @pytest.mark.parametrize('has_op_appregistry_manifests', [True, False])
     @pytest.mark.parametrize('has_op_bundle_manifests', [True, False])
     def test_binary_build_metadata_includes_exported_operator_manifests(
-            self, has_op_appregistry_manifests, has_op_bundle_manifests, workflow, source_dir
+            self, has_op_appregistry_manifests, has_op_bundle_manifests, workflow, koji_env
     ):
-        session = MockedClientSession('')
-        mock_environment(workflow, source_dir,
-                         has_op_appregistry_manifests=has_op_appregistry_manifests,
-                         has_op_bundle_manifests=has_op_bundle_manifests,
-                         name='ns/name', version='1.0', release='1',
-                         session=session)
+        session = koji_env(
+            has_op_appregistry_manifests=has_op_appregistry_manifests,
+            has_op_bundle_manifests=has_op_bundle_manifests,
+        )
 
         runner = create_runner(workflow)
         runner.run()
 
         data = session.metadata
-        assert 'build' in data
-        build = data['build']
-        assert isinstance(build, dict)
-        assert 'extra' in build
-        extra = build['extra']
+        extra = get_build_extra(data)
 
-        assert isinstance(extra, dict)
         assert 'osbs_build' in extra
         osbs_build = extra['osbs_build']
         assert 'typeinfo' in extra
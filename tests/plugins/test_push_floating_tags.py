@@ -10,29 +10,19 @@ import pytest
 import json
 import re
 import responses
-from tempfile import mkdtemp
-import os
+from functools import lru_cache
 
 from tests.constants import DOCKER0_REGISTRY
 from tests.mock_env import MockEnv
 from atomic_reactor.util import registry_hostname, ManifestDigest, sha256sum
-from osbs.utils import ImageName
 from atomic_reactor.plugins.push_floating_tags import PushFloatingTagsPlugin
 from atomic_reactor.constants import PLUGIN_GROUP_MANIFESTS_KEY
 
 
-def to_bytes(value):
-    if isinstance(value, bytes):
-        return value
-    else:
-        return bytes(value, 'utf-8')
-
-
-def to_text(value):
-    if isinstance(value, str):
-        return value
-    else:
-        return str(value, 'utf-8')
+@lru_cache(maxsize=256)
+def manifest_digest(manifest):
+    """Abbreviated digest the mock registry stores a manifest under"""
+    return sha256sum(manifest, abbrev_len=10, prefix=True)
 
 
 class MockRegistry(object):
@@ -41,48 +31,38 @@ class MockRegistry(object):
     """
     def __init__(self, registry):
         self.hostname = registry_hostname(registry)
-        self.repos = {}
+        # (repository, digest) => manifest
+        self.manifests = {}
+        # (repository, tag) => digest
+        self.tags = {}
         self._add_pattern(responses.PUT, r'/v2/(.*)/manifests/([^/]+)',
                           self._put_manifest)
 
-    def get_repo(self, name):
-        return self.repos.setdefault(name, {
-            'blobs': {},
-            'manifests': {},
-            'tags': {},
-        })
-
     def add_manifest(self, name, ref, manifest):
-        repo = self.get_repo(name)
-        digest = sha256sum(manifest, abbrev_len=10, prefix=True)
-        repo['manifests'][digest] = manifest
+        digest = manifest_digest(manifest)
+        self.manifests[(name, digest)] = manifest
         if ref.startswith('sha256:'):
             assert ref == digest
         else:
-            repo['tags'][ref] = digest
+            self.tags[(name, ref)] = digest
         return digest
 
     def get_manifest(self, name, ref):
-        repo = self.get_repo(name)
         if not ref.startswith('sha256:'):
-            ref = repo['tags'][ref]
-        return repo['manifests'][ref]
+            ref = self.tags[(name, ref)]
+        return self.manifests[(name, ref)]
 
     def _add_pattern(self, method, pattern, callback):
         pat = re.compile(r'^https://' + self.hostname + pattern + '$')
 
         def do_it(req):
-            status, headers, body = callback(req, *(pat.match(req.url).groups()))
-            if method == responses.HEAD:
-                return status, headers, ''
-            else:
-                return status, headers, body
+            return callback(req, *(pat.match(req.url).groups()))
 
         responses.add_callback(method, pat, do_it, match_querystring=True)
 
     def _put_manifest(self, req, name, ref):
         try:
-            json.loads(to_text(req.body))
+            json.loads(req.body)
         except ValueError:
             return (400, {}, {'error': 'BAD_MANIFEST'})
 
@@ -97,9 +77,7 @@ def mock_registries(registries, config, primary_images=None, manifest_results=No
     which registries should be prefilled (as if by the per-platform build tasks) with
     platform-specific manifests, and with what tags.
     """
-    reg_map = {}
-    for reg in registries:
-        reg_map[reg] = MockRegistry(reg)
+    reg_map = {reg: MockRegistry(reg) for reg in registries}
 
     per_platform_digests = {}
 
@@ -108,16 +86,9 @@ def mock_registries(registries, config, primary_images=None, manifest_results=No
 
         for reg, tags in regs.items():
             registry = reg_map[reg]
-            manifest = {'schemaVersion': 2}
-
-            if schema_version == 'v2':
-                manifest['mediaType'] = 'application/vnd.docker.distribution.manifest.v2+json'
-            elif schema_version == 'oci':
-                manifest['mediaType'] = 'application/vnd.oci.image.manifest.v1+json'
-
+            manifest_bytes = WORKER_MANIFESTS[schema_version]
             for t in tags:
                 name, tag = t.split(':')
-                manifest_bytes = to_bytes(json.dumps(manifest))
                 digest = registry.add_manifest(name, tag, manifest_bytes)
                 digests.append({
                     'registry': reg,
@@ -139,17 +110,29 @@ def mock_registries(registries, config, primary_images=None, manifest_results=No
         }
 
     if primary_images and manifest_results:
-        for _, registry in reg_map.items():
-            for image in primary_images:
-                name, tag = image.split(':')
-                repo = registry.get_repo(name)
-                manifest_digest = manifest_results["manifest_digest"]
-                repo["manifests"][manifest_digest.default] = manifest_results["manifest"]
-                repo["tags"][tag] = manifest_digest.default
+        primary_refs = [image.split(':') for image in primary_images]
+        digest = manifest_results["manifest_digest"].default
+        for registry in reg_map.values():
+            for name, tag in primary_refs:
+                registry.manifests[(name, digest)] = manifest_results["manifest"]
+                registry.tags[(name, tag)] = digest
 
     return reg_map, per_platform_digests
 
 
+@pytest.fixture(scope='module')
+def registries_cfg_dir(tmp_path_factory):
+    """Directory with a .dockercfg holding the credentials for REGISTRY_V2"""
+    cfg_dir = tmp_path_factory.mktemp('registries_cfg')
+    dockercfg = {
+        REGISTRY_V2: {
+            "username": "user", "password": DOCKER0_REGISTRY
+        }
+    }
+    (cfg_dir / '.dockercfg').write_text(json.dumps(dockercfg))
+    return str(cfg_dir)
+
+
 def mock_environment(workflow,
                      primary_images=None, floating_images=None,
                      manifest_results=None):
@@ -160,7 +143,8 @@ def mock_environment(workflow,
 
     if primary_images:
         for image in primary_images:
-            if '-' in ImageName.parse(image).tag:
+            # primary images of this module are all tagged repo:tag references
+            if '-' in image.rsplit(':', 1)[1]:
                 wf_data.tag_conf.add_primary_image(image)
         wf_data.tag_conf.add_unique_image(primary_images[0])
 
@@ -174,6 +158,23 @@ def mock_environment(workflow,
 
 REGISTRY_V2 = 'registry_v2.example.com'
 
+PLATFORM_DESCRIPTORS = [
+    {'platform': 'ppc64le', 'architecture': 'powerpc'},
+    {'platform': 'x86_64', 'architecture': 'amd64'},
+]
+
+# Platform-specific manifests pushed by the per-platform build tasks
+WORKER_MANIFESTS = {
+    'v2': json.dumps({
+        'schemaVersion': 2,
+        'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+    }).encode('utf-8'),
+    'oci': json.dumps({
+        'schemaVersion': 2,
+        'mediaType': 'application/vnd.oci.image.manifest.v1+json',
+    }).encode('utf-8'),
+}
+
 
 GROUPED_V2_RESULTS = {
     "manifest_digest": ManifestDigest(v2_list="sha256:11c3ecdbfa"),
@@ -268,135 +269,76 @@ NOGROUP_OCI_RESULTS = {
     }),
 }
 
+ONE_FLOATING_TAG = ['namespace/httpd:2.4-1']
+TWO_FLOATING_TAGS = ['namespace/httpd:2.4-1', 'namespace/httpd:latest']
 
-@pytest.mark.parametrize(('test_name',
-                          'manifest_results', 'schema_version',
+# Images pushed by the per-platform build tasks
+PPC64LE_IMAGES = {
+    'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
+}
+ALL_PLATFORMS_IMAGES = {
+    **PPC64LE_IMAGES,
+    'x86_64': ['namespace/httpd:unique-tag-x86_64'],
+}
+
+
+@pytest.mark.parametrize(('manifest_results', 'schema_version',
                           'floating_tags',
                           'per_platform_images', 'expected_skip_reason'), [
-    ("simple_grouped_v2",
-     GROUPED_V2_RESULTS, 'v2',
-     ['namespace/httpd:2.4-1'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-         'x86_64': ['namespace/httpd:unique-tag-x86_64']
-     },
-     None),
-    ("simple_grouped_oci",
-     GROUPED_OCI_RESULTS, 'oci',
-     ['namespace/httpd:2.4-1'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-         'x86_64': ['namespace/httpd:unique-tag-x86_64']
-     },
-     None),
-    ("multi_v2",
-     GROUPED_V2_RESULTS, 'v2',
-     ['namespace/httpd:2.4-1', 'namespace/httpd:latest'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-         'x86_64': ['namespace/httpd:unique-tag-x86_64']
-     },
-     None),
-    ("simple_ungrouped_v2",
-     NOGROUP_V2_RESULTS, 'v2',
-     ['namespace/httpd:2.4-1'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-     },
-     None),
-    ("simple_ungrouped_oci",
-     NOGROUP_OCI_RESULTS, 'oci',
-     ['namespace/httpd:2.4-1'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-     },
-     None),
-    ("multi_ungrouped_v2",
-     NOGROUP_V2_RESULTS, 'v2',
-     ['namespace/httpd:2.4-1', 'namespace/httpd:latest'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-     },
-     None),
-    ("multi_ungrouped_oci",
-     NOGROUP_OCI_RESULTS, 'oci',
-     ['namespace/httpd:2.4-1', 'namespace/httpd:latest'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-     },
-     None),
-    ("No tags",
-     GROUPED_V2_RESULTS, 'v2',
-     None,
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-         'x86_64': ['namespace/httpd:unique-tag-x86_64']
-     },
-     'No floating images to tag, skipping push_floating_tags'),
-    ("No_results",
-     None, 'oci',
-     ['namespace/httpd:2.4-1', 'namespace/httpd:latest'],
-     {
-         'ppc64le': ['namespace/httpd:unique-tag-ppc64le'],
-         'x86_64': ['namespace/httpd:unique-tag-x86_64']
-     },
-     'No manifest digest available, skipping push_floating_tags'),
+    pytest.param(GROUPED_V2_RESULTS, 'v2', ONE_FLOATING_TAG, ALL_PLATFORMS_IMAGES, None,
+                 id='simple_grouped_v2'),
+    pytest.param(GROUPED_OCI_RESULTS, 'oci', ONE_FLOATING_TAG, ALL_PLATFORMS_IMAGES, None,
+                 id='simple_grouped_oci'),
+    pytest.param(GROUPED_V2_RESULTS, 'v2', TWO_FLOATING_TAGS, ALL_PLATFORMS_IMAGES, None,
+                 id='multi_v2'),
+    pytest.param(NOGROUP_V2_RESULTS, 'v2', ONE_FLOATING_TAG, PPC64LE_IMAGES, None,
+                 id='simple_ungrouped_v2'),
+    pytest.param(NOGROUP_OCI_RESULTS, 'oci', ONE_FLOATING_TAG, PPC64LE_IMAGES, None,
+                 id='simple_ungrouped_oci'),
+    pytest.param(NOGROUP_V2_RESULTS, 'v2', TWO_FLOATING_TAGS, PPC64LE_IMAGES, None,
+                 id='multi_ungrouped_v2'),
+    pytest.param(NOGROUP_OCI_RESULTS, 'oci', TWO_FLOATING_TAGS, PPC64LE_IMAGES, None,
+                 id='multi_ungrouped_oci'),
+    pytest.param(GROUPED_V2_RESULTS, 'v2', None, ALL_PLATFORMS_IMAGES,
+                 'No floating images to tag, skipping push_floating_tags',
+                 id='no_tags'),
+    pytest.param(None, 'oci', TWO_FLOATING_TAGS, ALL_PLATFORMS_IMAGES,
+                 'No manifest digest available, skipping push_floating_tags',
+                 id='no_results'),
 ])
 @responses.activate  # noqa
-def test_floating_tags_push(workflow, tmpdir, test_name, manifest_results,
+def test_floating_tags_push(workflow, registries_cfg_dir, manifest_results,
                             schema_version, floating_tags, per_platform_images,
                             expected_skip_reason, caplog):
     primary_images = ['namespace/httpd:2.4', 'namespace/httpd:primary']
 
-    goarch = {
-        'ppc64le': 'powerpc',
-        'x86_64': 'amd64',
-    }
-
     registry_conf = {
-        REGISTRY_V2: {'version': 'v2', 'insecure': True},
+        REGISTRY_V2: {'version': 'v2', 'insecure': True, 'secret': registries_cfg_dir},
     }
 
-    temp_dir = mkdtemp(dir=str(tmpdir))
-    with open(os.path.join(temp_dir, ".dockercfg"), "w+") as dockerconfig:
-        dockerconfig_contents = {
-            REGISTRY_V2: {
-                "username": "user", "password": DOCKER0_REGISTRY
-            }
+    mocked_registries = {}
+    # Skipped cases must not talk to any registry, so none is mocked for them
+    if expected_skip_reason is None:
+        registry_images_conf = {
+            platform: {REGISTRY_V2: images} for platform, images in per_platform_images.items()
         }
-        dockerconfig.write(json.dumps(dockerconfig_contents))
-        dockerconfig.flush()
-        registry_conf[REGISTRY_V2]['secret'] = temp_dir
-
-    registry_images_conf = {
-        platform: {REGISTRY_V2: images} for platform, images in per_platform_images.items()
-    }
-
-    mocked_registries, _ = mock_registries(registry_conf, registry_images_conf,
-                                           primary_images=primary_images,
-                                           manifest_results=manifest_results,
-                                           schema_version=schema_version)
+        mocked_registries, _ = mock_registries(registry_conf, registry_images_conf,
+                                               primary_images=primary_images,
+                                               manifest_results=manifest_results,
+                                               schema_version=schema_version)
     env = mock_environment(workflow,
                            primary_images=primary_images,
                            floating_images=floating_tags,
                            manifest_results=manifest_results)
 
-    platform_descriptors_list = []
-    for platform, arch in goarch.items():
-        new_plat = {
-            'platform': platform,
-            'architecture': arch,
-        }
-        platform_descriptors_list.append(new_plat)
-
     rcm = {
         'version': 1,
         'registry': {
             'url': f'https://{REGISTRY_V2}/{registry_conf[REGISTRY_V2]["version"]}',
             'auth': True,
         },
-        'platform_descriptors': platform_descriptors_list,
-        'registries_cfg_path': str(temp_dir),
+        'platform_descriptors': PLATFORM_DESCRIPTORS,
+        'registries_cfg_path': registries_cfg_dir,
     }
     env.set_reactor_config(rcm)
 
@@ -406,14 +348,12 @@ def test_floating_tags_push(workflow, tmpdir, test_name, manifest_results,
 
     if expected_skip_reason is None:
         primary_name, primary_tag = primary_images[0].split(':')
-        for registry in registry_conf:
-            target_registry = mocked_registries[registry]
+        floating_refs = [image.split(':') for image in floating_tags]
+        for target_registry in mocked_registries.values():
             primary_manifest_list = target_registry.get_manifest(primary_name, primary_tag)
 
-            for image in floating_tags:
-                name, tag = image.split(':')
-
-                assert tag in target_registry.get_repo(name)['tags']
+            for name, tag in floating_refs:
+                assert (name, tag) in target_registry.tags
                 assert target_registry.get_manifest(name, tag) == primary_manifest_list
 
         # Check that plugin returns ManifestDigest object
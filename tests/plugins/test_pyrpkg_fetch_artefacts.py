@@ -19,6 +19,10 @@ from tests.stubs import StubSource
 from flexmock import flexmock
 
 
+SOURCES_COMMAND = 'fedpkg sources'
+EXPECTED_COMMAND = ['fedpkg', 'sources']
+
+
 class Y(object):
     dockerfile_path = None
     path = None
@@ -29,13 +33,21 @@ class X(object):
     base_image = ImageName.parse('asd')
 
 
-def test_distgit_fetch_artefacts_plugin(tmpdir, workflow):  # noqa
-    command = 'fedpkg sources'
-    expected_command = ['fedpkg', 'sources']
-
+@pytest.fixture
+def workflow(workflow, tmpdir):
+    """Workflow building from a stub dist-git source checked out in tmpdir"""
     workflow.source = StubSource()
     workflow.source.path = str(tmpdir)
+    return workflow
 
+
+def create_runner(workflow):
+    return (MockEnv(workflow)
+            .for_plugin(DistgitFetchArtefactsPlugin.key)
+            .create_runner())
+
+
+def test_distgit_fetch_artefacts_plugin(tmpdir, workflow):  # noqa
     initial_dir = os.getcwd()
     assert initial_dir != str(tmpdir)
 
@@ -44,39 +56,28 @@ def test_distgit_fetch_artefacts_plugin(tmpdir, workflow):  # noqa
 
     (flexmock(pyrpkg_fetch_artefacts.subprocess)
         .should_receive('check_call')
-        .with_args(expected_command)
+        .with_args(EXPECTED_COMMAND)
         .replace_with(assert_tmpdir)
         .once())
-    workflow.conf.conf['sources_command'] = command
+    workflow.conf.conf['sources_command'] = SOURCES_COMMAND
 
-    (MockEnv(workflow)
-     .for_plugin(DistgitFetchArtefactsPlugin.key)
-     .create_runner()
-     .run())
+    create_runner(workflow).run()
 
     assert os.getcwd() == initial_dir
 
 
 def test_distgit_fetch_artefacts_failure(tmpdir, workflow):  # noqa
-    command = 'fedpkg sources'
-    expected_command = ['fedpkg', 'sources']
-
-    workflow.source = StubSource()
-    workflow.source.path = str(tmpdir)
-
     initial_dir = os.getcwd()
     assert initial_dir != str(tmpdir)
 
     (flexmock(pyrpkg_fetch_artefacts.subprocess)
         .should_receive('check_call')
-        .with_args(expected_command)
+        .with_args(EXPECTED_COMMAND)
         .and_raise(RuntimeError)
         .once())
-    workflow.conf.conf['sources_command'] = command
+    workflow.conf.conf['sources_command'] = SOURCES_COMMAND
 
-    runner = (MockEnv(workflow)
-              .for_plugin(DistgitFetchArtefactsPlugin.key)
-              .create_runner())
+    runner = create_runner(workflow)
 
     with pytest.raises(PluginFailedException):
         runner.run()
@@ -84,14 +85,8 @@ def test_distgit_fetch_artefacts_failure(tmpdir, workflow):  # noqa
     assert os.getcwd() == initial_dir
 
 
-def test_distgit_fetch_artefacts_skip(tmpdir, workflow, caplog):  # noqa
-    workflow.source = StubSource()
-    workflow.source.path = str(tmpdir)
-
-    (MockEnv(workflow)
-     .for_plugin(DistgitFetchArtefactsPlugin.key)
-     .create_runner()
-     .run())
+def test_distgit_fetch_artefacts_skip(workflow, caplog):  # noqa
+    create_runner(workflow).run()
 
     log_msg = 'no sources command configuration, skipping plugin'
     assert log_msg in caplog.text